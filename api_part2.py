@@ -1,10 +1,10 @@
-import json
 from datetime import datetime
-from typing import Optional, Any
-import redis
+from typing import Optional
+import redis.asyncio as redis
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, EmailStr
 import uvicorn
+from final_project.cache import CacheManager
 
 class SupplierBase(BaseModel):
     name: str
@@ -28,42 +28,9 @@ redis_client = redis.Redis(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=REDIS_DB,
-    decode_responses=True
 )
 
-class CacheManager:
-    @staticmethod
-    def generate_cache_key(endpoint: str, **kwargs) -> str:
-        key_parts = [f"api:{endpoint}"]
-        for k, v in sorted(kwargs.items()):
-            key_parts.append(f"{k}:{v}")
-        return ":".join(key_parts)
-
-    @staticmethod
-    def get_from_cache(key: str) -> Optional[Any]:
-        try:
-            cached = redis_client.get(key)
-            if cached:
-                return json.loads(cached)
-        except:
-            pass
-        return None
-
-    @staticmethod
-    def set_to_cache(key: str, data: Any, ttl: int = CACHE_TTL):
-        try:
-            redis_client.setex(key, ttl, json.dumps(data, default=str))
-        except:
-            pass
-
-    @staticmethod
-    def invalidate_cache(pattern: str = "api:*"):
-        try:
-            keys = redis_client.keys(pattern)
-            if keys:
-                redis_client.delete(*keys)
-        except:
-            pass
+cache = CacheManager(redis_client, CACHE_TTL)
 
 
 app = FastAPI(
@@ -73,6 +40,11 @@ app = FastAPI(
 )
 
 
+@app.on_event("startup")
+async def start_cache_listener():
+    cache.start_listener()
+
+
 class StatisticsRequest(BaseModel):
     email: EmailStr
 
@@ -80,21 +52,21 @@ class StatisticsRequest(BaseModel):
 @app.get("/sallers")
 async def get_all_suppliers():
     cache_key = CacheManager.generate_cache_key("all_suppliers")
-    cached = CacheManager.get_from_cache(cache_key)
+    cached = await cache.get_from_cache(cache_key)
     if cached is not None:
         return cached
     session = db.get_session()
     suppliers = session.query(Supplier).all()
     result = [{"id": s.id, "name": s.name} for s in suppliers]
     session.close()
-    CacheManager.set_to_cache(cache_key, result)
+    await cache.set_to_cache(cache_key, result, tags=["suppliers"])
     return result
 
 
 @app.get("/sallers/{supplier_id}")
 async def get_supplier_by_id(supplier_id: int):
     cache_key = CacheManager.generate_cache_key("supplier_by_id", id=supplier_id)
-    cached = CacheManager.get_from_cache(cache_key)
+    cached = await cache.get_from_cache(cache_key)
     if cached is not None:
         return cached
     session = db.get_session()
@@ -103,7 +75,7 @@ async def get_supplier_by_id(supplier_id: int):
     if not supplier:
         raise HTTPException(status_code=404, detail="Поставщик не найден")
     result = {"id": supplier.id, "name": supplier.name}
-    CacheManager.set_to_cache(cache_key, result)
+    await cache.set_to_cache(cache_key, result, tags=[f"supplier:{supplier_id}"])
     return result
 
 
@@ -117,14 +89,14 @@ async def update_supplier(supplier_id: int, name: str):
     supplier.name = name
     session.commit()
     session.close()
-    CacheManager.invalidate_cache("api:*supplier*")
+    await cache.invalidate_tags("suppliers", f"supplier:{supplier_id}")
     return {"updated": True, "id": supplier_id, "name": name}
 
 
 @app.post("/statistics/")
 async def get_statistics(request: StatisticsRequest):
     cache_key = CacheManager.generate_cache_key("statistics", email=request.email)
-    cached = CacheManager.get_from_cache(cache_key)
+    cached = await cache.get_from_cache(cache_key)
     if cached:
         return {"cached": True, "data": cached}
     session = db.get_session()
@@ -135,7 +107,7 @@ async def get_statistics(request: StatisticsRequest):
         "email": request.email,
         "timestamp": datetime.now().isoformat(),
     }
-    CacheManager.set_to_cache(cache_key, stats)
+    await cache.set_to_cache(cache_key, stats, tags=["suppliers"])
     return {"data": stats}
 
 
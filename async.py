@@ -1,5 +1,7 @@
 import asyncio
 import aiohttp
+from final_project.limits import Counters, RateLimiter, RetryPolicy
+from final_project.http_client import create_session
 class BaseParser:
     def loader(self, categories):
         pass
@@ -17,27 +19,58 @@ class WoysaParser(BaseParser):
 
     def __init__(self):
         self.base_url = "https://analitika.woysa.club/images/panel/json/download/niches.php"
+        if not hasattr(self, "session"):
+            self.session = None
+            self.counters = Counters()
+            self.limiter = RateLimiter(10, 20, self.counters)
+            self.retry = RetryPolicy(counters=self.counters)
 
-    async def download(self, session, skip, category):
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = create_session()
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def download(self, skip, category):
         url = self.base_url + f"?skip={skip}&price_min=0&price_max=1060225&up_vy_min=0&up_vy_max=108682515&up_vy_pr_min=0&up_vy_pr_max=2900&sum_min=1000&sum_max=82432725&feedbacks_min=0&feedbacks_max=32767&trend=false&sort=sum_sale&sort_dir=-1&id_cat={category}"
-        async with session.get(url) as response:
-            if response.status == 200:
-                return await response.json()
-            return []
+        last_attempt = self.retry.attempts - 1
+        for attempt in range(self.retry.attempts):
+            await self.limiter.acquire_async(url)
+            try:
+                async with self.get_session().get(url) as response:
+                    if attempt < last_attempt and self.retry.should_retry(response.status):
+                        retry_after = response.headers.get("Retry-After")
+                    else:
+                        if self.retry.should_retry(response.status):
+                            response.raise_for_status()
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        return []
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == last_attempt:
+                    raise
+                retry_after = None
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
 
     async def loader(self, categories):
         all_data = []
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for cat in categories:
-                for skip in [0, 100, 200]:
-                    task = self.download(session, skip, cat)
-                    tasks.append(task)
+        tasks = []
+        for cat in categories:
+            for skip in [0, 100, 200]:
+                task = self.download(skip, cat)
+                tasks.append(task)
 
+        try:
             for task in asyncio.as_completed(tasks):
                 page_data = await task
                 if page_data:
                     all_data.extend(page_data)
+        finally:
+            await self.close()
 
         return all_data
 
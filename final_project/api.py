@@ -1,185 +1,415 @@
+import base64
+import binascii
+import csv
+import hashlib
+import io
 import json
-import redis
-from typing import Optional, Any
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from db import db, Seller, SKU
-from sqlalchemy import func
-
-REDIS_HOST = "localhost"
-REDIS_PORT = 6379
-REDIS_DB = 1
-CACHE_TTL = 300
-
-redis_client = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=REDIS_DB,
-    decode_responses=True
-)
-
-
-class CacheManager:
-    @staticmethod
-    def generate_cache_key(endpoint: str, **kwargs) -> str:
-        key_parts = [f"api:{endpoint}"]
-        for k, v in sorted(kwargs.items()):
-            key_parts.append(f"{k}:{v}")
-        return ":".join(key_parts)
-
-    @staticmethod
-    def get_from_cache(key: str) -> Optional[Any]:
-        try:
-            cached = redis_client.get(key)
-            if cached:
-                return json.loads(cached)
-        except:
-            pass
-        return None
-
-    @staticmethod
-    def set_to_cache(key: str, data: Any, ttl: int = CACHE_TTL):
-        try:
-            redis_client.setex(key, ttl, json.dumps(data, default=str))
-        except:
-            pass
-
-
-class SellerResponse(BaseModel):
-    id: int
-    seller_id: str
-    name: Optional[str]
-    store: Optional[str]
-    brand: Optional[str]
-
-    class Config:
-        from_attributes = True
-
-
-class SKUResponse(BaseModel):
-    id: int
-    sku_id: str
-    name: str
-    category_id: int
-    seller_id: str
-    price: Optional[float]
-    sum_sale: Optional[float]
-
-    class Config:
-        from_attributes = True
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from redis.exceptions import RedisError
+from cache import CacheManager
+from cache_client import INGEST_JOBS_KEY, INGEST_STATUS_KEY, cache, redis_client
+from db import async_db, Brand, Seller, SKU, Store, SellerStats, CategoryStats, BrandStats
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HTTP_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def encode_sort_cursor(last_id: int, value) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id, "value": value}).encode()).decode()
+
+
+def parse_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        payload["id"] = int(payload["id"])
+        if payload.get("value") is not None:
+            payload["value"] = float(payload["value"])
+        return payload
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    return parse_cursor(cursor)["id"]
+
+
+async def get_cached_total(session: AsyncSession, model) -> int:
+    cache_key = CacheManager.generate_cache_key("total", table=model.__tablename__)
+    total = await cache.get_from_cache(cache_key)
+    if total is None:
+        total = await session.scalar(select(func.count(model.id)))
+        await cache.set_to_cache(cache_key, total, tags=[model.__tablename__])
+    return total
+
+
+SELLER_COLUMNS = [Seller.id, Seller.seller_id, Seller.name, Store.name.label("store"), Brand.name.label("brand")]
+SKU_COLUMNS = [
+    SKU.id, SKU.sku_id, SKU.name, SKU.category_id, SKU.seller_id, SKU.price, SKU.sum_sale,
+    SKU.up_vy, SKU.up_vy_pr, SKU.feedbacks, SKU.trend
+]
+# сортировки по убыванию, у каждой есть индекс (колонка, id) для keyset-пагинации
+PRODUCT_SORTS = {"up_vy": SKU.up_vy, "feedbacks": SKU.feedbacks}
+PRODUCT_FILTERS = {
+    "min_price": lambda value: SKU.price >= value,
+    "max_price": lambda value: SKU.price <= value,
+    "min_up_vy": lambda value: SKU.up_vy >= value,
+    "max_up_vy": lambda value: SKU.up_vy <= value,
+    "min_feedbacks": lambda value: SKU.feedbacks >= value,
+    "max_feedbacks": lambda value: SKU.feedbacks <= value,
+}
+STATS_FIELDS = ["sku_count", "total_sale", "avg_sale", "price_p25", "price_p50", "price_p75"]
+
+
+def select_sellers():
+    # магазин и бренд — справочники, join идёт по первичным ключам
+    return (
+        select(*SELLER_COLUMNS)
+        .outerjoin(Store, Store.id == Seller.store_id)
+        .outerjoin(Brand, Brand.id == Seller.brand_id)
+    )
+
+
+async def export_rows(stmt, fmt: str):
+    # отдельная сессия: ответ стримится уже после выхода из зависимостей FastAPI
+    async with async_db.Session() as session:
+        result = await session.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(result.keys())
+
+        async for rows in result.partitions():
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(row._mapping), ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+def export_response(stmt, fmt: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        export_rows(stmt, fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"}
+    )
+
+
+class FastJSONResponse(JSONResponse):
+    # ответы уже собраны из колонок и не требуют повторной валидации
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return super().render(content)
+
+
+def make_etag(cache_key: str, versions) -> str:
+    digest = hashlib.sha1(f"{cache_key}:{versions}".encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def cached_response(request: Request, cache_key: str, tags, loader, *args):
+    # 304 отдаётся по версиям тегов, не трогая БД и не сериализуя ответ; пока слушатель
+    # инвалидаций подписан, версии берутся из памяти процесса без похода в Redis
+    headers = {"Cache-Control": HTTP_CACHE_CONTROL}
+    versions = await cache.get_versions(tags)
+    if versions is not None:
+        headers["ETag"] = make_etag(cache_key, versions)
+        if etag_matches(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    # запись хранит версии, прочитанные до загрузки: ответ, собранный до инвалидации,
+    # не получит новый ETag
+    data = await cache.get_or_set(cache_key, loader, *args, tags=tags, versions=versions)
+    return FastJSONResponse(data, headers=headers)
 
 
 app = FastAPI(
     title="API",
     description="API по продовцам WB",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 
-@app.get("/category/{category_id}")
-async def get_category_data(category_id: int):
-    cache_key = CacheManager.generate_cache_key("category", id=category_id)
-    cached = CacheManager.get_from_cache(cache_key)
-    if cached is not None:
-        return cached
+# загрузка выполняется в worker.py, процесс API только читает БД
+@app.on_event("startup")
+async def startup_event():
+    await async_db.check_tables()
+    cache.start_listener()
 
-    session = db.get_session()
-    skus = session.query(SKU).filter(SKU.category_id == category_id).all()
 
-    if not skus:
-        session.close()
-        raise HTTPException(status_code=404, detail=f"Нет данных для категории {category_id}")
+@app.on_event("shutdown")
+async def shutdown_event():
+    await cache.stop_listener()
+    await redis_client.aclose()
+    await async_db.close()
 
-    seller_ids = list(set([sku.seller_id for sku in skus]))
-    sellers = session.query(Seller).filter(Seller.seller_id.in_(seller_ids)).all()
 
-    response = {
-        "category_id": category_id,
-        "total_skus": len(skus),
-        "total_sellers": len(sellers),
-        "sellers": [SellerResponse.from_orm(seller).dict() for seller in sellers],
-        "skus": [SKUResponse.from_orm(sku).dict() for sku in skus[:100]]
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        "counters": dict(cache.stats),
+        "circuit_open": not cache.breaker.allow(),
+        "local_entries": len(cache.local.entries),
+        "local_bytes": cache.local.size
     }
 
-    session.close()
-    CacheManager.set_to_cache(cache_key, response)
-    return response
-
 
-@app.get("/sallesr/")
-async def get_all_sellers(limit: int = 100, offset: int = 0):
-    cache_key = CacheManager.generate_cache_key("all_sellers", limit=limit, offset=offset)
-    cached = CacheManager.get_from_cache(cache_key)
-    if cached is not None:
-        return cached
-
-    session = db.get_session()
-    sellers = session.query(Seller).offset(offset).limit(limit).all()
-    total = session.query(func.count(Seller.id)).scalar()
-    session.close()
-
-    response = {
-        "total": total,
-        "limit": limit,
-        "offset": offset,
-        "sellers": [SellerResponse.from_orm(seller).dict() for seller in sellers]
+@app.get("/ingest/status")
+async def get_ingest_status():
+    # статус пишут процессы worker.py, API его только читает
+    try:
+        queued = await redis_client.llen(INGEST_JOBS_KEY)
+        statuses = await redis_client.hgetall(INGEST_STATUS_KEY)
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Статус загрузки недоступен")
+    return {
+        "queued": queued,
+        "categories": {int(category_id): json.loads(status) for category_id, status in statuses.items()}
     }
 
-    CacheManager.set_to_cache(cache_key, response)
-    return response
 
+async def load_category_data(category_id: int):
+    async with async_db.Session() as session:
+        result = await session.execute(
+            select(func.count(SKU.id), func.count(SKU.seller_id.distinct())).where(SKU.category_id == category_id)
+        )
+        total_skus, total_sellers = result.one()
 
-@app.get("/sallesr/{seller_id}")
-async def get_seller_sales(seller_id: str):
-    cache_key = CacheManager.generate_cache_key("seller_sales", id=seller_id)
-    cached = CacheManager.get_from_cache(cache_key)
-    if cached is not None:
-        return cached
+        if not total_skus:
+            raise HTTPException(status_code=404, detail=f"Нет данных для категории {category_id}")
+
+        result = await session.execute(
+            select(*SKU_COLUMNS).where(SKU.category_id == category_id).order_by(SKU.sum_sale.desc()).limit(100)
+        )
+        skus = [dict(row) for row in result.mappings()]
 
-    session = db.get_session()
-    seller = session.query(Seller).filter(Seller.seller_id == seller_id).first()
+        # только продавцы отданных SKU, а не вся категория
+        seller_ids = {sku["seller_id"] for sku in skus}
+        result = await session.execute(
+            select_sellers().where(Seller.seller_id.in_(seller_ids)).order_by(Seller.id)
+        )
+        sellers = [dict(row) for row in result.mappings()]
 
-    if not seller:
-        session.close()
-        raise HTTPException(status_code=404, detail=f"Продавец {seller_id} не найден")
+    return {
+        "category_id": category_id,
+        "total_skus": total_skus,
+        "total_sellers": total_sellers,
+        "sellers": sellers,
+        "skus": skus
+    }
 
-    skus = session.query(SKU).filter(SKU.seller_id == seller_id).all()
-    session.close()
-    total_sales = sum(sku.sum_sale or 0 for sku in skus)
-    total_skus = len(skus)
 
-    response = {
-        "seller": SellerResponse.from_orm(seller).dict(),
+@app.get("/category/{category_id}")
+async def get_category_data(category_id: int, request: Request):
+    cache_key = CacheManager.generate_cache_key("category", id=category_id)
+    return await cached_response(request, cache_key, [f"category:{category_id}"], load_category_data, category_id)
+
+
+async def load_all_sellers(limit: int, after_id: int, with_total: bool):
+    async with async_db.Session() as session:
+        result = await session.execute(
+            select_sellers().where(Seller.id > after_id).order_by(Seller.id).limit(limit)
+        )
+        sellers = [dict(row) for row in result.mappings()]
+
+        response = {
+            "limit": limit,
+            "next_cursor": encode_cursor(sellers[-1]["id"]) if len(sellers) == limit else None,
+            "sellers": sellers
+        }
+        if with_total:
+            response["total"] = await get_cached_total(session, Seller)
+    return response
+
+
+@app.get("/sallesr/")
+async def get_all_sellers(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    with_total: bool = False
+):
+    after_id = decode_cursor(cursor)
+    cache_key = CacheManager.generate_cache_key("all_sellers", limit=limit, cursor=cursor, with_total=with_total)
+    return await cached_response(request, cache_key, ["sellers"], load_all_sellers, limit, after_id, with_total)
+
+
+async def load_seller_sales(seller_id: str):
+    async with async_db.Session() as session:
+        result = await session.execute(select_sellers().where(Seller.seller_id == seller_id))
+        seller = result.mappings().first()
+
+        if not seller:
+            raise HTTPException(status_code=404, detail=f"Продавец {seller_id} не найден")
+
+        stats = await session.get(SellerStats, seller_id)
+        if stats is not None:
+            total_skus, total_sales = stats.sku_count, stats.total_sale
+        else:
+            result = await session.execute(
+                select(func.count(SKU.id), func.coalesce(func.sum(SKU.sum_sale), 0)).where(SKU.seller_id == seller_id)
+            )
+            total_skus, total_sales = result.one()
+
+        result = await session.execute(
+            select(*SKU_COLUMNS).where(SKU.seller_id == seller_id).order_by(SKU.sum_sale.desc()).limit(50)
+        )
+        skus = [dict(row) for row in result.mappings()]
+
+    return {
+        "seller": dict(seller),
         "statistics": {
             "total_skus": total_skus,
             "total_sales": total_sales,
             "average_price": total_sales / total_skus if total_skus > 0 else 0
         },
-        "skus": [SKUResponse.from_orm(sku).dict() for sku in skus[:50]]
+        "skus": skus
     }
 
-    CacheManager.set_to_cache(cache_key, response)
+
+@app.get("/sallesr/{seller_id}")
+async def get_seller_sales(seller_id: str, request: Request):
+    cache_key = CacheManager.generate_cache_key("seller_sales", id=seller_id)
+    return await cached_response(request, cache_key, [f"seller:{seller_id}"], load_seller_sales, seller_id)
+
+
+async def load_all_products(limit: int, after: Optional[dict], with_total: bool, filters: dict, sort: str):
+    conditions = [PRODUCT_FILTERS[name](value) for name, value in filters.items()]
+    stmt = select(*SKU_COLUMNS).where(*conditions)
+    sort_column = PRODUCT_SORTS.get(sort)
+    if sort_column is None:
+        if after:
+            stmt = stmt.where(SKU.id > after["id"])
+        stmt = stmt.order_by(SKU.id)
+    else:
+        stmt = stmt.where(sort_column.is_not(None))
+        if after:
+            if after.get("value") is None:
+                raise HTTPException(status_code=400, detail="Некорректный курсор")
+            stmt = stmt.where(tuple_(sort_column, SKU.id) < tuple_(after["value"], after["id"]))
+        stmt = stmt.order_by(sort_column.desc(), SKU.id.desc())
+
+    async with async_db.Session() as session:
+        result = await session.execute(stmt.limit(limit))
+        skus = [dict(row) for row in result.mappings()]
+
+        next_cursor = None
+        if len(skus) == limit:
+            last = skus[-1]
+            next_cursor = encode_cursor(last["id"]) if sort_column is None else encode_sort_cursor(last["id"], last[sort])
+
+        response = {
+            "limit": limit,
+            "next_cursor": next_cursor,
+            "products": skus
+        }
+        if with_total:
+            if conditions:
+                response["total"] = await session.scalar(select(func.count(SKU.id)).where(*conditions))
+            else:
+                response["total"] = await get_cached_total(session, SKU)
     return response
 
 
 @app.get("/products/")
-async def get_all_products(limit: int = 100, offset: int = 0):
-    cache_key = CacheManager.generate_cache_key("all_products", limit=limit, offset=offset)
-    cached = CacheManager.get_from_cache(cache_key)
-    if cached is not None:
-        return cached
-
-    session = db.get_session()
-    skus = session.query(SKU).offset(offset).limit(limit).all()
-    total = session.query(func.count(SKU.id)).scalar()
-    session.close()
-
-    response = {
-        "total": total,
-        "limit": limit,
-        "offset": offset,
-        "products": [SKUResponse.from_orm(sku).dict() for sku in skus]
+async def get_all_products(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+    sort: str = Query("id", pattern="^(id|up_vy|feedbacks)$"),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_up_vy: Optional[float] = None,
+    max_up_vy: Optional[float] = None,
+    min_feedbacks: Optional[int] = None,
+    max_feedbacks: Optional[int] = None
+):
+    after = parse_cursor(cursor) if cursor else None
+    filters = {
+        name: value for name, value in [
+            ("min_price", min_price), ("max_price", max_price),
+            ("min_up_vy", min_up_vy), ("max_up_vy", max_up_vy),
+            ("min_feedbacks", min_feedbacks), ("max_feedbacks", max_feedbacks),
+        ] if value is not None
     }
+    cache_key = CacheManager.generate_cache_key(
+        "all_products", limit=limit, cursor=cursor, with_total=with_total, sort=sort, **filters
+    )
+    return await cached_response(
+        request, cache_key, ["skus"], load_all_products, limit, after, with_total, filters, sort
+    )
+
+
+async def load_stats(model, key, value):
+    async with async_db.Session() as session:
+        columns = [getattr(model, field) for field in STATS_FIELDS]
+        result = await session.execute(select(*columns).where(getattr(model, key) == value))
+        stats = result.mappings().first()
+        if stats is None:
+            raise HTTPException(status_code=404, detail=f"Нет статистики для {value}")
+        return {key: value, **stats}
+
+
+async def get_stats(request: Request, model, key, value, tag):
+    cache_key = CacheManager.generate_cache_key("stats", table=model.__tablename__, id=value)
+    return await cached_response(request, cache_key, [tag], load_stats, model, key, value)
+
+
+@app.get("/stats/sellers/{seller_id}")
+async def get_seller_stats(seller_id: str, request: Request):
+    return await get_stats(request, SellerStats, "seller_id", seller_id, f"seller:{seller_id}")
+
+
+@app.get("/stats/categories/{category_id}")
+async def get_category_stats(category_id: int, request: Request):
+    return await get_stats(request, CategoryStats, "category_id", category_id, f"category:{category_id}")
+
+
+@app.get("/stats/brands/{brand}")
+async def get_brand_stats(brand: str, request: Request):
+    return await get_stats(request, BrandStats, "brand", brand, f"brand:{brand}")
+
+
+@app.get("/export/category/{category_id}")
+async def export_category(category_id: int, fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")):
+    stmt = select(*SKU_COLUMNS).where(SKU.category_id == category_id).order_by(SKU.id)
+    return export_response(stmt, fmt, f"category_{category_id}")
+
 
-    CacheManager.set_to_cache(cache_key, response)
-    return response
\ No newline at end of file
+@app.get("/export/products/")
+async def export_products(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")):
+    stmt = select(*SKU_COLUMNS).order_by(SKU.id)
+    return export_response(stmt, fmt, "products")
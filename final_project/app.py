@@ -1,109 +1,174 @@
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import aiohttp
-import json
 import uvicorn
-from api import app
-from db import db, Seller, SKU
+from http_client import create_session
+from ingest import BulkIngest
+from json_stream import JsonArrayDecoder
+from limits import Counters, RateLimiter, RetryPolicy
+from pipeline import IngestPipeline
+from stats import StatsUpdater
+
+RATE_LIMIT = 10
+RATE_BURST = 20
+RETRY_ATTEMPTS = 5
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_BATCH_SIZE = 500
+STREAM_PAGE_BUFFER = 50
+SYNC_CATEGORIES = [1, 2, 3]
+NORMALIZE_WORKERS = 0
 
 
 class WoysaParser:
-    def __init__(self):
+    def __init__(self, page_size=100, pages_in_flight=3, requests_in_flight=10, page_buffer=STREAM_PAGE_BUFFER):
         self.base_url = "https://analitika.woysa.club/images/panel/json/download/niches.php"
+        self.page_size = page_size
+        self.pages_in_flight = pages_in_flight
+        self.page_buffer = page_buffer
+        self.requests_limit = asyncio.Semaphore(requests_in_flight)
+        self.counters = Counters()
+        self.limiter = RateLimiter(RATE_LIMIT, RATE_BURST, self.counters)
+        self.retry = RetryPolicy(RETRY_ATTEMPTS, counters=self.counters)
+        self.session = None
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = create_session()
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def open_response(self, url):
+        session = await self.start()
+        last_attempt = self.retry.attempts - 1
+        for attempt in range(self.retry.attempts):
+            await self.limiter.acquire_async(url)
+            try:
+                response = await session.get(url)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == last_attempt:
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt))
+                continue
 
-    async def download(self, session, skip, category):
-        url = self.base_url + f"?skip={skip}&id_cat={category}"
-        async with session.get(url) as response:
-            if response.status == 200:
-                return await response.json()
-            return []
-
-    async def load_category(self, category):
-        all_data = []
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for skip in [0, 100, 200]:
-                task = self.download(session, skip, category)
-                tasks.append(task)
+            if attempt < last_attempt and self.retry.should_retry(response.status):
+                if response.status == 429:
+                    self.counters.incr("rate_limited")
+                retry_after = response.headers.get("Retry-After")
+                response.release()
+                await asyncio.sleep(self.retry.delay(attempt, retry_after))
+                continue
+            return response
 
-            for task in asyncio.as_completed(tasks):
-                page_data = await task
-                if page_data:
-                    all_data.extend(page_data)
+    def check_status(self, response):
+        if self.retry.should_retry(response.status):
+            self.counters.incr("failed")
+            response.raise_for_status()
+        return response.status == 200
 
-        return all_data
+    async def stream_page(self, skip, category):
+        url = self.base_url + f"?skip={skip}&id_cat={category}"
+        async with self.requests_limit:
+            async with await self.open_response(url) as response:
+                if not self.check_status(response):
+                    return
+                decoder = JsonArrayDecoder()
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    for item in decoder.feed(chunk):
+                        yield item
+                for item in decoder.close():
+                    yield item
+
+    async def fill_page(self, skip, category, queue):
+        # строки страницы уходят в очередь по мере разбора; None — конец страницы
+        try:
+            async for item in self.stream_page(skip, category):
+                await queue.put(item)
+        except Exception as error:
+            await queue.put(error)
+        else:
+            await queue.put(None)
+
+    async def stream_category(self, category, batch_size=STREAM_BATCH_SIZE):
+        # окно из pages_in_flight страниц качается параллельно, но читается по порядку
+        # страниц и строка за строкой: в памяти не больше page_buffer строк на страницу
+        # и одного батча; останавливаемся на первой короткой странице
+        batch = []
+        skip = 0
+        finished = False
+        while not finished:
+            queues = [asyncio.Queue(self.page_buffer) for _ in range(self.pages_in_flight)]
+            tasks = [
+                asyncio.create_task(self.fill_page(skip + i * self.page_size, category, queue))
+                for i, queue in enumerate(queues)
+            ]
+            skip += self.pages_in_flight * self.page_size
+            try:
+                for queue in queues:
+                    count = 0
+                    while True:
+                        item = await queue.get()
+                        if item is None:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        count += 1
+                        batch.append(item)
+                        if len(batch) >= batch_size:
+                            yield batch
+                            batch = []
+                    if count < self.page_size:
+                        finished = True
+                        break
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        if batch:
+            yield batch
 
 
 class DataService:
-    def __init__(self):
+    def __init__(self, normalize_workers=NORMALIZE_WORKERS):
         self.parser = WoysaParser()
-
-    async def load_and_save_data(self):
-
-        for category_id in [1, 2, 3]:
-            print(f"Загрузка категории {category_id}...")
-            raw_data = await self.parser.load_category(category_id)
-
-            if not raw_data:
-                print(f"Нет данных {category_id}")
-                continue
-
-            session = db.get_session()
-            sellers_seen = set()
-            skus_seen = set()
-
-            for item in raw_data:
-                if not isinstance(item, dict):
-                    continue
-
-                seller_id = str(item.get('id', '')) or str(item.get('seller_id', ''))
-                if not seller_id:
-                    continue
-
-                if seller_id not in sellers_seen:
-                    seller = Seller(
-                        seller_id=seller_id,
-                        name=item.get('name', '')[:200],
-                        store=item.get('store', ''),
-                        brand=item.get('brand', '')
-                    )
-                    session.add(seller)
-                    sellers_seen.add(seller_id)
-
-                sku_id = str(item.get('id_cat', '')) + "_" + seller_id
-                if sku_id not in skus_seen:
-                    additional = {
-                        'up_vy': item.get('up_vy'),
-                        'up_vy_pr': item.get('up_vy_pr'),
-                        'feedbacks': item.get('feedbacks'),
-                        'trend': item.get('trend')
-                    }
-
-                    sku = SKU(
-                        sku_id=sku_id,
-                        name=item.get('name', '')[:500],
-                        category_id=category_id,
-                        seller_id=seller_id,
-                        price=float(item.get('price', 0)),
-                        sum_sale=float(item.get('sum_sale', 0)),
-                        additional_data=json.dumps(additional)
-                    )
-                    session.add(sku)
-                    skus_seen.add(sku_id)
-
-            session.commit()
-            session.close()
-
-            print(f"Категория {category_id}: {len(sellers_seen)} продавцов, {len(skus_seen)} SKU")
-
-
-data_service = DataService()
-
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(data_service.load_and_save_data())
+        self.ingest = BulkIngest()
+        self.stats = StatsUpdater(self.ingest)
+        # 0 — разбор в event loop, иначе в отдельных процессах
+        self.executor = None
+        if normalize_workers:
+            self.executor = ProcessPoolExecutor(normalize_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def pipeline(self):
+        return IngestPipeline(self.parser, self.ingest, self.stats, self.executor)
+
+    async def close(self):
+        await self.parser.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def load_and_save_data(self, categories=SYNC_CATEGORIES):
+        # категории качаются параллельно и пишутся одним писателем по мере готовности батчей
+        print(f"Загрузка категорий {categories}...")
+        results = await self.pipeline().run(categories)
+        print(f"Статистика загрузки: {self.parser.counters.snapshot()}")
+        return results
+
+    async def sync_category(self, category_id, progress=None):
+        results = await self.pipeline().run([category_id], progress)
+        return results[category_id]
 
 
 def run_api():
+    # api импортируется только здесь: worker.py берёт из этого модуля DataService
+    # и не должен собирать приложение FastAPI
+    from api import app
+
     print("Запуск API")
     print("API: http://localhost:8000/docs")
 
@@ -0,0 +1,279 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+import api
+from api import SKU_COLUMNS, FastJSONResponse, encode_cursor, parse_cursor
+from db import db, async_db, migrate_indexes, AsyncDatabase, SKU
+from frames import group_by, length, to_frame, top_n
+from normalize import SELLER_ROW_FIELDS, SKU_ROW_FIELDS, as_dicts, normalize_items, normalize_with_pool
+
+QUERIES = {
+    "category_top": "SELECT * FROM skus WHERE category_id = :category_id ORDER BY sum_sale DESC LIMIT 100",
+    "seller_skus": "SELECT * FROM skus WHERE seller_id = :seller_id",
+    "seller_lookup": "SELECT * FROM sellers WHERE seller_id = :seller_id",
+}
+
+
+def seed(conn, sellers, skus, categories):
+    conn.execute(
+        text("INSERT INTO sellers (seller_id, name) VALUES (:seller_id, :name)"),
+        [{"seller_id": str(i), "name": f"Продавец {i}"} for i in range(sellers)]
+    )
+    conn.execute(
+        text(
+            "INSERT INTO skus (sku_id, name, category_id, seller_id, price, sum_sale) "
+            "VALUES (:sku_id, :name, :category_id, :seller_id, :price, :sum_sale)"
+        ),
+        [
+            {
+                "sku_id": f"sku_{i}",
+                "name": f"Товар {i}",
+                "category_id": random.randint(1, categories),
+                "seller_id": str(random.randrange(sellers)),
+                "price": random.uniform(10, 10000),
+                "sum_sale": random.uniform(1000, 1000000),
+            }
+            for i in range(skus)
+        ]
+    )
+
+
+def measure(conn, queries, params, repeat):
+    results = {}
+    for name, sql in queries.items():
+        plan = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(text(sql), params).fetchall()
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+        results[name] = (elapsed, " | ".join(row[-1] for row in plan))
+    return results
+
+
+def bench_indexes(sellers=20000, skus=200000, categories=50, repeat=50):
+    engine = create_engine("sqlite://")
+    metadata = db.Base.metadata
+    params = {"category_id": 1, "seller_id": str(sellers // 2)}
+
+    with engine.begin() as conn:
+        metadata.create_all(conn)
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(conn)
+        seed(conn, sellers, skus, categories)
+        before = measure(conn, QUERIES, params, repeat)
+        migrate_indexes(conn, metadata)
+        conn.execute(text("ANALYZE"))
+        after = measure(conn, QUERIES, params, repeat)
+
+    print(f"Индексы: {sellers} продавцов, {skus} SKU")
+    for name in QUERIES:
+        print(f"\n{name}")
+        print(f"  без индексов: {before[name][0]:8.3f} мс  {before[name][1]}")
+        print(f"  с индексами:  {after[name][0]:8.3f} мс  {after[name][1]}")
+
+
+def bench_pagination(skus=500000, page=100, repeat=20):
+    # файловая база: её же читает load_all_products через async_db
+    path = os.path.join(tempfile.mkdtemp(), "pagination.db")
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        db.Base.metadata.create_all(conn)
+        seed(conn, 1000, skus, 50)
+        last_ids = conn.execute(text("SELECT id FROM skus ORDER BY id")).scalars().all()
+
+        print(f"\nПагинация: {skus} SKU, страница {page}")
+        print(f"{'глубина':>10} {'OFFSET, мс':>12} {'курсор, мс':>12}")
+        for depth in [0, skus // 10, skus // 2, skus - page]:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(
+                    text("SELECT * FROM skus ORDER BY id LIMIT :limit OFFSET :offset"),
+                    {"limit": page, "offset": depth}
+                ).fetchall()
+            offset_ms = (time.perf_counter() - started) / repeat * 1000
+
+            after_id = last_ids[depth - 1] if depth else 0
+            started = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(
+                    text("SELECT * FROM skus WHERE id > :after_id ORDER BY id LIMIT :limit"),
+                    {"limit": page, "after_id": after_id}
+                ).fetchall()
+            keyset_ms = (time.perf_counter() - started) / repeat * 1000
+            print(f"{depth:>10} {offset_ms:>12.3f} {keyset_ms:>12.3f}")
+    engine.dispose()
+
+    shallow_ms, deep_ms = asyncio.run(measure_products(path, last_ids[-page - 1], page, repeat))
+    ratio = deep_ms / shallow_ms
+    print(f"  load_all_products: первая страница {shallow_ms:.3f} мс, последняя {deep_ms:.3f} мс, x{ratio:.2f}")
+    assert ratio < 3, "глубокая страница курсора заметно медленнее первой"
+
+
+async def measure_products(path, deep_id, page, repeat):
+    api.async_db = AsyncDatabase(db.Base, f"sqlite+aiosqlite:///{path}")
+    try:
+        timings = []
+        for after in [None, parse_cursor(encode_cursor(deep_id))]:
+            response = await api.load_all_products(page, after, False, {}, "id")
+            assert len(response["products"]) == page
+            assert after is None or response["products"][0]["id"] > deep_id
+            started = time.perf_counter()
+            for _ in range(repeat):
+                await api.load_all_products(page, after, False, {}, "id")
+            timings.append((time.perf_counter() - started) / repeat * 1000)
+        return timings
+    finally:
+        await api.async_db.close()
+        api.async_db = async_db
+
+
+class SKUResponse(BaseModel):
+    id: int
+    sku_id: str
+    name: str
+    category_id: int
+    seller_id: str
+    price: Optional[float]
+    sum_sale: Optional[float]
+    up_vy: Optional[float]
+    up_vy_pr: Optional[float]
+    feedbacks: Optional[int]
+    trend: Optional[float]
+
+    class Config:
+        from_attributes = True
+
+
+def bench_encoding(skus=100, repeat=500):
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        db.Base.metadata.create_all(conn)
+        seed(conn, 100, skus, 1)
+
+    with Session(engine) as session:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            rows = session.execute(select(SKU).limit(skus)).scalars().all()
+            content = [SKUResponse.from_orm(sku).dict() for sku in rows]
+            json.dumps(jsonable_encoder(content)).encode()
+            session.expunge_all()
+        orm_ms = (time.perf_counter() - started) / repeat * 1000
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = session.execute(select(*SKU_COLUMNS).limit(skus))
+            FastJSONResponse([dict(row) for row in result.mappings()])
+        fast_ms = (time.perf_counter() - started) / repeat * 1000
+
+    print(f"\nКодирование ответа: {skus} SKU")
+    print(f"  ORM + from_orm + jsonable_encoder + json: {orm_ms:8.3f} мс")
+    print(f"  колонки + orjson:                         {fast_ms:8.3f} мс")
+
+
+def raw_items(count, sellers):
+    return [
+        {
+            "id": random.randrange(sellers),
+            "id_cat": random.randint(1, 50),
+            "name": f"Товар {i}",
+            "store": "",
+            "brand": f"Бренд {i % 100}",
+            "price": random.uniform(10, 10000),
+            "sum_sale": random.uniform(1000, 1000000),
+            "up_vy": random.randint(0, 1000),
+            "up_vy_pr": random.randint(0, 100),
+            "feedbacks": random.randint(0, 5000),
+            "trend": random.random() > 0.5,
+        }
+        for i in range(count)
+    ]
+
+
+def bench_normalize(items=200000, sellers=20000, processes=4):
+    data = raw_items(items, sellers)
+
+    started = time.perf_counter()
+    serial = normalize_items(data, 1, set(), set())
+    serial_ms = (time.perf_counter() - started) * 1000
+
+    with ProcessPoolExecutor(processes) as executor:
+        normalize_with_pool(executor, data[:1000], 1, set(), set())
+        started = time.perf_counter()
+        sellers_rows, skus_rows = normalize_with_pool(executor, data, 1, set(), set())
+        pool_ms = (time.perf_counter() - started) * 1000
+
+    pooled = (as_dicts(SELLER_ROW_FIELDS, sellers_rows), as_dicts(SKU_ROW_FIELDS, skus_rows))
+    assert pooled == serial, "результат пула процессов отличается от последовательного"
+
+    print(f"\nНормализация: {items} строк")
+    print(f"  последовательно:       {serial_ms:8.1f} мс")
+    print(f"  {processes} процесса:           {pool_ms:8.1f} мс")
+
+
+def bench_frames(items=500000, sellers=20000, n=10):
+    data = raw_items(items, sellers)
+
+    started = time.perf_counter()
+    by_seller = {}
+    by_category = {}
+    for item in data:
+        for groups, key in ((by_seller, str(item["id"])), (by_category, item["id_cat"])):
+            group = groups.setdefault(key, [0, 0.0, []])
+            group[0] += 1
+            group[1] += item["sum_sale"]
+        by_category[item["id_cat"]][2].append(item)
+    means = {key: total / count for key, (count, total, _) in by_seller.items()}
+    top = sorted(data, key=lambda item: item["sum_sale"], reverse=True)[:n]
+    category_top = {
+        key: sorted(items, key=lambda item: item["sum_sale"], reverse=True)[:n]
+        for key, (_, _, items) in by_category.items()
+    }
+    loop_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    frame = to_frame(data, ["id_cat", "seller_id", "sum_sale"])
+    frame_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    groups = group_by(frame, "seller_id")
+    group_by(frame, "id_cat")
+    frame_top = top_n(frame, "sum_sale", n)
+    frame_category_top = top_n(frame, "sum_sale", n, key="id_cat")
+    vector_ms = (time.perf_counter() - started) * 1000
+
+    assert len(groups["key"]) == len(by_seller)
+    assert np.allclose(groups["mean"], [means[key] for key in groups["key"].tolist()])
+    assert length(frame_category_top) == sum(len(items) for items in category_top.values())
+    assert [item["sum_sale"] for item in top] == frame_top["sum_sale"].tolist()
+
+    print(f"\nGroup-by и top-{n}: {items} строк, {len(by_seller)} продавцов")
+    print(f"  цикл по dict:             {loop_ms:8.1f} мс")
+    print(f"  построение frame:         {frame_ms:8.1f} мс")
+    print(f"  векторные group-by/top-N: {vector_ms:8.1f} мс")
+    print(f"  frame целиком:            {frame_ms + vector_ms:8.1f} мс")
+
+
+BENCHMARKS = {
+    "indexes": bench_indexes,
+    "pagination": bench_pagination,
+    "encoding": bench_encoding,
+    "normalize": bench_normalize,
+    "frames": bench_frames,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,579 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Optional
+from redis.exceptions import LockError, RedisError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+INVALIDATION_CHANNEL = "api:invalidate"
+LOCAL_MAX_ENTRIES = 1000
+LOCAL_MAX_BYTES = 64 * 1024 * 1024
+TAG_PREFIX = "tag:"
+VERSION_PREFIX = "version:"
+INVALIDATE_CHUNK = 500
+LOCAL_TTL = 60
+STALE_TTL = 60
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+EARLY_REFRESH_BETA = 1.0
+CIRCUIT_MAX_FAILURES = 3
+CIRCUIT_RESET_TIMEOUT = 30
+COMPRESS_MIN_SIZE = 1024
+LOCAL_MAX_VERSIONS = 100000
+
+FORMAT_JSON = 1
+FORMAT_ORJSON = 2
+FORMAT_MSGPACK = 3
+
+CODEC_NONE = 0
+CODEC_ZSTD = 1
+CODEC_LZ4 = 2
+
+
+class Serializer:
+    # первый байт записи — формат, второй — сжатие; так старые и новые
+    # форматы могут жить в Redis одновременно на время выкатки
+    def __init__(self, fmt=None, codec=None, compress_min_size=COMPRESS_MIN_SIZE):
+        if fmt is None:
+            fmt = FORMAT_ORJSON if orjson is not None else FORMAT_JSON
+        if codec is None:
+            codec = CODEC_ZSTD if zstandard is not None else CODEC_LZ4 if lz4_frame is not None else CODEC_NONE
+        self.format = fmt
+        self.codec = codec
+        self.compress_min_size = compress_min_size
+        self.zstd_compressor = zstandard.ZstdCompressor() if zstandard is not None else None
+        self.zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def encode(self, fmt, value) -> bytes:
+        if fmt == FORMAT_ORJSON:
+            return orjson.dumps(value, default=str)
+        if fmt == FORMAT_MSGPACK:
+            return msgpack.packb(value, default=str, use_bin_type=True)
+        return json.dumps(value, default=str).encode()
+
+    def decode(self, fmt, body: bytes):
+        if fmt == FORMAT_ORJSON:
+            return orjson.loads(body)
+        if fmt == FORMAT_MSGPACK:
+            return msgpack.unpackb(body, raw=False)
+        if fmt == FORMAT_JSON:
+            return json.loads(body)
+        raise ValueError(f"Неизвестный формат кэша: {fmt}")
+
+    def compress(self, codec, body: bytes) -> bytes:
+        if codec == CODEC_ZSTD:
+            return self.zstd_compressor.compress(body)
+        if codec == CODEC_LZ4:
+            return lz4_frame.compress(body)
+        return body
+
+    def decompress(self, codec, body: bytes) -> bytes:
+        if codec == CODEC_ZSTD:
+            return self.zstd_decompressor.decompress(body)
+        if codec == CODEC_LZ4:
+            return lz4_frame.decompress(body)
+        if codec == CODEC_NONE:
+            return body
+        raise ValueError(f"Неизвестное сжатие кэша: {codec}")
+
+    def dumps(self, value) -> tuple:
+        # вместе с записью возвращается размер несжатого тела: столько значение
+        # и занимает в памяти, в отличие от сжатого payload
+        body = self.encode(self.format, value)
+        codec = self.codec if len(body) >= self.compress_min_size else CODEC_NONE
+        return bytes([self.format, codec]) + self.compress(codec, body), len(body)
+
+    def loads(self, payload: bytes) -> tuple:
+        if payload[:1] == b"{":
+            # записи, сохранённые до появления байта версии
+            return json.loads(payload), len(payload)
+        body = self.decompress(payload[1], payload[2:])
+        return self.decode(payload[0], body), len(body)
+
+
+def as_str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class LocalCache:
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES, max_bytes=LOCAL_MAX_BYTES, ttl=LOCAL_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[int] = None):
+        if size > self.max_bytes:
+            return
+        ttl = min(ttl or self.ttl, self.ttl)
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, size, value)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+
+    def delete(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class CircuitBreaker:
+    def __init__(self, max_failures=CIRCUIT_MAX_FAILURES, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        # после паузы пропускаем пробный запрос, чтобы проверить, ожил ли Redis
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+
+
+class CacheManager:
+    def __init__(self, redis_client, ttl: int, local: Optional[LocalCache] = None,
+                 stale_ttl: int = STALE_TTL, stale_while_revalidate: bool = True,
+                 serializer: Optional[Serializer] = None):
+        self.redis = redis_client
+        self.serializer = serializer or Serializer()
+        self.ttl = ttl
+        self.local = local or LocalCache()
+        self.stale_ttl = stale_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.breaker = CircuitBreaker()
+        self.stats = Counter()
+        self.inflight = {}
+        self.refreshing = set()
+        self.listener = None
+        # версии тегов в памяти процесса; верны, пока слушатель подписан на канал
+        self.versions = {}
+        self.subscribed = False
+
+    @staticmethod
+    def generate_cache_key(endpoint: str, **kwargs) -> str:
+        key_parts = [f"api:{endpoint}"]
+        for k, v in sorted(kwargs.items()):
+            key_parts.append(f"{k}:{v}")
+        return ":".join(key_parts)
+
+    def available(self) -> bool:
+        if self.breaker.allow():
+            return True
+        self.stats["skipped"] += 1
+        return False
+
+    def record_success(self):
+        self.breaker.success()
+
+    def record_error(self):
+        self.stats["errors"] += 1
+        self.breaker.failure()
+
+    def decode_entry(self, key: str, cached) -> Optional[dict]:
+        if not cached:
+            self.stats["misses"] += 1
+            return None
+        try:
+            entry, size = self.serializer.loads(cached)
+            if not isinstance(entry, dict) or "expires" not in entry:
+                raise ValueError("Запись кэша без конверта")
+        except Exception:
+            # ответы, записанные до конверта с expires, и битые записи — промах,
+            # а не 500: ключ удаляется и значение пересчитывается
+            self.stats["unreadable"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        remaining = entry["expires"] - time.time()
+        if remaining > 0:
+            self.local.set(key, entry, size, remaining)
+        return entry
+
+    def encode_entry(self, key: str, data: Any, ttl: int, delta: float = 0.0, versions=None) -> bytes:
+        # versions — версии тегов, прочитанные до загрузки данных; по ним строится ETag
+        entry = {"data": data, "expires": time.time() + ttl, "delta": delta, "versions": versions}
+        payload, size = self.serializer.dumps(entry)
+        self.local.set(key, entry, size, ttl)
+        return payload
+
+    def queue_write(self, pipe, key: str, payload: bytes, ttl: int, tags=()):
+        # Redis держит запись дольше ttl, чтобы было что отдать в режиме stale-while-revalidate
+        pipe.setex(key, ttl + self.stale_ttl, payload)
+        for tag in tags:
+            pipe.sadd(TAG_PREFIX + tag, key)
+            pipe.expire(TAG_PREFIX + tag, ttl + self.stale_ttl)
+
+    async def read_entry(self, key: str) -> Optional[dict]:
+        entry = self.local.get(key)
+        if entry is not None:
+            self.stats["local_hits"] += 1
+            return entry
+        if not self.available():
+            return None
+        try:
+            cached = await self.redis.get(key)
+        except RedisError:
+            self.record_error()
+            return None
+        self.record_success()
+        entry = self.decode_entry(key, cached)
+        if entry is None and cached:
+            await self.drop(key)
+        return entry
+
+    async def read_entries(self, keys) -> dict:
+        entries = {}
+        missing = []
+        for key in keys:
+            entry = self.local.get(key)
+            if entry is not None:
+                self.stats["local_hits"] += 1
+                entries[key] = entry
+            else:
+                missing.append(key)
+        if not missing or not self.available():
+            return entries
+        try:
+            values = await self.redis.mget(missing)
+        except RedisError:
+            self.record_error()
+            return entries
+        self.record_success()
+        unreadable = []
+        for key, cached in zip(missing, values):
+            entry = self.decode_entry(key, cached)
+            if entry is not None:
+                entries[key] = entry
+            elif cached:
+                unreadable.append(key)
+        await self.drop(*unreadable)
+        return entries
+
+    async def drop(self, *keys: str):
+        if not keys:
+            return
+        try:
+            await self.redis.unlink(*keys)
+        except RedisError:
+            self.record_error()
+
+    async def write_entry(self, key: str, data: Any, ttl: int, delta: float = 0.0, tags=(), versions=None):
+        payload = self.encode_entry(key, data, ttl, delta, versions)
+        if not self.available():
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self.queue_write(pipe, key, payload, ttl, tags)
+            await pipe.execute()
+        except RedisError:
+            self.record_error()
+            return
+        self.record_success()
+
+    async def get_from_cache(self, key: str) -> Optional[Any]:
+        entry = await self.read_entry(key)
+        if entry is not None and entry["expires"] > time.time():
+            return entry["data"]
+        return None
+
+    async def get_many(self, keys) -> dict:
+        now = time.time()
+        entries = await self.read_entries(keys)
+        return {key: entry["data"] for key, entry in entries.items() if entry["expires"] > now}
+
+    async def set_to_cache(self, key: str, data: Any, ttl: Optional[int] = None, tags=()):
+        await self.write_entry(key, data, ttl or self.ttl, tags=tags)
+
+    async def set_many(self, items: dict, ttl: Optional[int] = None, tags=()):
+        ttl = ttl or self.ttl
+        payloads = {key: self.encode_entry(key, data, ttl) for key, data in items.items()}
+        if not payloads or not self.available():
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, payload in payloads.items():
+                self.queue_write(pipe, key, payload, ttl, tags)
+            await pipe.execute()
+        except RedisError:
+            self.record_error()
+            return
+        self.record_success()
+
+    def is_fresh(self, entry: dict) -> bool:
+        # вероятностное раннее обновление (XFetch): чем дольше считается значение,
+        # тем раньше до истечения ttl один из запросов начнёт его пересчитывать
+        early = entry["delta"] * EARLY_REFRESH_BETA * -math.log(1 - random.random())
+        return time.time() + early < entry["expires"]
+
+    @staticmethod
+    def matches(entry: dict, versions) -> bool:
+        # запись, загруженная до инвалидации тегов, не отдаётся, даже если ещё лежит в кэше
+        return versions is None or entry.get("versions") == list(versions)
+
+    async def get_or_set(self, key: str, loader, *args, ttl: Optional[int] = None, tags=(), versions=None) -> Any:
+        ttl = ttl or self.ttl
+        entry = await self.read_entry(key)
+        if entry is not None and not self.matches(entry, versions):
+            self.stats["outdated"] += 1
+            entry = None
+        if entry is not None:
+            if self.is_fresh(entry):
+                return entry["data"]
+            if entry["expires"] > time.time() or self.stale_while_revalidate:
+                self.stats["stale"] += 1
+                self.refresh_in_background(key, loader, args, ttl, tags, versions)
+                return entry["data"]
+        return await self.load_once(key, loader, args, ttl, tags, versions)
+
+    def refresh_in_background(self, key: str, loader, args, ttl: int, tags, versions=None):
+        if self.flight_key(key, versions) in self.inflight or key in self.refreshing:
+            return
+        self.refreshing.add(key)
+        task = asyncio.ensure_future(self.load_locked(key, loader, args, ttl, tags, False, versions))
+        task.add_done_callback(lambda done: self.finish_refresh(key, done))
+
+    @staticmethod
+    def flight_key(key: str, versions):
+        # запросы с разными версиями тегов не ждут чужую загрузку
+        return key, tuple(versions) if versions is not None else None
+
+    def finish_refresh(self, key: str, task):
+        self.refreshing.discard(key)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Не удалось обновить кэш {key}: {task.exception()}")
+
+    async def load_once(self, key: str, loader, args, ttl: int, tags, versions=None):
+        # внутри процесса одновременные промахи ждут один и тот же future
+        flight = self.flight_key(key, versions)
+        future = self.inflight.get(flight)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[flight] = future
+        try:
+            data = await self.load_locked(key, loader, args, ttl, tags, True, versions)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            del self.inflight[flight]
+
+    async def acquire_lock(self, key: str):
+        if not self.available():
+            return None, True
+        lock = self.redis.lock(f"lock:{key}", timeout=LOCK_TIMEOUT)
+        try:
+            locked = await lock.acquire(blocking=False)
+        except RedisError:
+            self.record_error()
+            return None, True
+        self.record_success()
+        return (lock if locked else None), locked
+
+    async def load_locked(self, key: str, loader, args, ttl: int, tags, wait: bool, versions=None):
+        # между воркерами значение пересчитывает только владелец блокировки в Redis
+        lock, locked = await self.acquire_lock(key)
+
+        if not locked:
+            if not wait:
+                return None
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                entry = await self.read_entry(key)
+                if entry is not None and entry["expires"] > time.time() and self.matches(entry, versions):
+                    return entry["data"]
+
+        try:
+            started = time.monotonic()
+            data = await loader(*args)
+            await self.write_entry(key, data, ttl, time.monotonic() - started, tags, versions)
+            return data
+        finally:
+            if lock is not None:
+                try:
+                    await lock.release()
+                except (RedisError, LockError):
+                    pass
+
+    async def invalidate(self, *keys: str):
+        self.local.delete(*keys)
+        if not keys:
+            return
+        try:
+            for start in range(0, len(keys), INVALIDATE_CHUNK):
+                chunk = keys[start:start + INVALIDATE_CHUNK]
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.unlink(*chunk)
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps(chunk))
+                await pipe.execute()
+        except RedisError:
+            self.record_error()
+            self.local.clear()
+
+    def remember_versions(self, versions: dict):
+        if len(self.versions) > LOCAL_MAX_VERSIONS:
+            self.versions.clear()
+        for tag, version in versions.items():
+            # max: ответ MGET, начатого до инвалидации, не откатит версию из канала
+            self.versions[tag] = max(self.versions.get(tag, 0), int(version))
+
+    async def get_versions(self, tags) -> Optional[list]:
+        # версия тега растёт при каждой инвалидации; None — Redis недоступен
+        if self.subscribed and all(tag in self.versions for tag in tags):
+            self.stats["local_versions"] += 1
+            return [self.versions[tag] for tag in tags]
+        if not self.available():
+            return None
+        try:
+            values = await self.redis.mget([VERSION_PREFIX + tag for tag in tags])
+        except RedisError:
+            self.record_error()
+            return None
+        self.record_success()
+        versions = dict(zip(tags, (int(value or 0) for value in values)))
+        if self.subscribed:
+            self.remember_versions(versions)
+        return [versions[tag] for tag in tags]
+
+    async def invalidate_tags(self, *tags: str):
+        # сначала удаляются сами ответы, потом растут версии: иначе в промежутке
+        # новый ETag отдавался бы вместе со старым телом
+        if not tags:
+            return
+        try:
+            keys = set()
+            for tag in tags:
+                async for key in self.redis.sscan_iter(TAG_PREFIX + tag, count=INVALIDATE_CHUNK):
+                    keys.add(as_str(key))
+        except RedisError:
+            self.record_error()
+            self.local.clear()
+            self.versions.clear()
+            return
+        await self.invalidate(*keys)
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.unlink(*[TAG_PREFIX + tag for tag in tags])
+            for tag in tags:
+                pipe.incr(VERSION_PREFIX + tag)
+            results = await pipe.execute()
+            versions = dict(zip(tags, results[1:]))
+            self.remember_versions(versions)
+            await self.redis.publish(INVALIDATION_CHANNEL, json.dumps({"versions": versions}))
+        except RedisError:
+            self.record_error()
+            self.local.clear()
+            self.versions.clear()
+
+    async def invalidate_cache(self, pattern: str = "api:*"):
+        try:
+            keys = [as_str(key) async for key in self.redis.scan_iter(match=pattern, count=INVALIDATE_CHUNK)]
+        except RedisError:
+            self.record_error()
+            self.local.clear()
+            return
+        await self.invalidate(*keys)
+
+    def start_listener(self):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.ensure_future(self.listen())
+
+    async def stop_listener(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+
+    async def listen(self):
+        while True:
+            try:
+                async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    # пока подписки не было, сообщения могли потеряться
+                    self.local.clear()
+                    self.versions.clear()
+                    self.subscribed = True
+                    async for message in pubsub.listen():
+                        payload = json.loads(message["data"])
+                        if isinstance(payload, dict):
+                            self.remember_versions(payload["versions"])
+                        else:
+                            self.local.delete(*payload)
+            except RedisError:
+                await asyncio.sleep(1)
+            finally:
+                self.subscribed = False
@@ -0,0 +1,31 @@
+import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+from cache import CacheManager
+
+# общие настройки Redis для API и воркеров загрузки: воркеры импортируют этот
+# модуль, а не api, и не собирают приложение FastAPI
+REDIS_HOST = "localhost"
+REDIS_PORT = 6379
+REDIS_DB = 1
+REDIS_MAX_CONNECTIONS = 50
+REDIS_TIMEOUT = 0.5
+CACHE_TTL = 300
+INGEST_JOBS_KEY = "ingest:jobs"
+INGEST_QUEUED_KEY = "ingest:queued"
+INGEST_STATUS_KEY = "ingest:status"
+
+redis_pool = redis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_TIMEOUT,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    # повторы с backoff не нужны: при недоступном Redis срабатывает circuit breaker
+    retry=Retry(NoBackoff(), 1),
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+
+cache = CacheManager(redis_client, CACHE_TTL)
@@ -1,5 +1,76 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import create_engine, inspect, text, Column, ForeignKey, Index, Integer, String, Float, Text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+
+# строковая колонка sellers в старых базах -> (справочник, внешний ключ)
+LEGACY_DICTIONARIES = {
+    "store": ("stores", "store_id"),
+    "brand": ("brands", "brand_id"),
+}
+
+def migrate_columns(conn, metadata):
+    # новые nullable-колонки добавляются в существующие таблицы через ALTER TABLE
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                # info["backfill"] — SQL-выражение для заполнения колонки из уже сохранённых данных
+                if "backfill" in column.info:
+                    conn.execute(text(f"UPDATE {table.name} SET {column.name} = {column.info['backfill']}"))
+
+def migrate_dictionaries(conn):
+    # магазин и бренд раньше хранились строками в sellers: переносим их в справочники
+    inspector = inspect(conn)
+    if not inspector.has_table("sellers"):
+        return
+    existing = {column["name"] for column in inspector.get_columns("sellers")}
+    for legacy, (table, key) in LEGACY_DICTIONARIES.items():
+        if legacy not in existing:
+            continue
+        conn.execute(text(
+            f"INSERT INTO {table} (name) SELECT DISTINCT {legacy} FROM sellers "
+            f"WHERE {legacy} <> '' AND {legacy} NOT IN (SELECT name FROM {table})"
+        ))
+        conn.execute(text(
+            f"UPDATE sellers SET {key} = (SELECT id FROM {table} WHERE {table}.name = sellers.{legacy}) "
+            f"WHERE {key} IS NULL AND {legacy} <> ''"
+        ))
+
+def migrate_indexes(conn, metadata):
+    # create_all не трогает существующие таблицы, поэтому индексы
+    # для старых файлов woysa_sales.db создаются здесь
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                columns = ", ".join(column.name for column in index.columns)
+                conn.execute(text(
+                    f"DELETE FROM {table.name} WHERE id NOT IN "
+                    f"(SELECT MAX(id) FROM {table.name} GROUP BY {columns})"
+                ))
+            index.create(conn)
+
+def missing_schema(conn, metadata):
+    # только чтение схемы: таблицы и колонки модели, которых нет в базе
+    inspector = inspect(conn)
+    missing = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in existing]
+    return missing
 
 class Database:
     def __init__(self, db_url="sqlite:///woysa_sales.db"):
@@ -9,11 +80,39 @@ class Database:
 
     def create_tables(self):
         self.Base.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            migrate_columns(conn, self.Base.metadata)
+            migrate_dictionaries(conn)
+            migrate_indexes(conn, self.Base.metadata)
 
     def get_session(self):
         return self.Session()
 
+class AsyncDatabase:
+    def __init__(self, base, db_url="sqlite+aiosqlite:///woysa_sales.db"):
+        self.engine = create_async_engine(db_url)
+        self.Base = base
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def create_tables(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(self.Base.metadata.create_all)
+            await conn.run_sync(migrate_columns, self.Base.metadata)
+            await conn.run_sync(migrate_dictionaries)
+            await conn.run_sync(migrate_indexes, self.Base.metadata)
+
+    async def check_tables(self):
+        # процесс API схему не меняет: миграции выполняет только worker.py
+        async with self.engine.connect() as conn:
+            missing = await conn.run_sync(missing_schema, self.Base.metadata)
+        if missing:
+            raise RuntimeError(f"Схема БД не обновлена, запустите python worker.py migrate: {', '.join(missing)}")
+
+    async def close(self):
+        await self.engine.dispose()
+
 db = Database()
+async_db = AsyncDatabase(db.Base)
 
 class BaseTable(db.Base):
     __abstract__ = True
@@ -23,23 +122,74 @@ class BaseTable(db.Base):
             if hasattr(self, key):
                 setattr(self, key, value)
 
+class Store(BaseTable):
+    __tablename__ = 'stores'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False, unique=True, index=True)
+    sellers = relationship("Seller", back_populates="store")
+
+class Brand(BaseTable):
+    __tablename__ = 'brands'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False, unique=True, index=True)
+    sellers = relationship("Seller", back_populates="brand")
+
 class Seller(BaseTable):
     __tablename__ = 'sellers'
     id = Column(Integer, primary_key=True)
-    seller_id = Column(String(100), nullable=False)
+    seller_id = Column(String(100), nullable=False, unique=True, index=True)
     name = Column(String(200))
-    store = Column(String(200))
-    brand = Column(String(200))
+    store_id = Column(Integer, ForeignKey('stores.id'), index=True)
+    brand_id = Column(Integer, ForeignKey('brands.id'), index=True)
+    row_hash = Column(String(40))
+    # справочники маленькие и нужны почти всегда — подтягиваются тем же запросом
+    store = relationship("Store", back_populates="sellers", lazy="joined")
+    brand = relationship("Brand", back_populates="sellers", lazy="joined")
+    # коллекция большая: грузить явно через selectinload(Seller.skus)
+    skus = relationship("SKU", back_populates="seller")
 
 class SKU(BaseTable):
     __tablename__ = 'skus'
     id = Column(Integer, primary_key=True)
-    sku_id = Column(String(100), nullable=False)
+    sku_id = Column(String(100), nullable=False, unique=True, index=True)
     name = Column(String(500))
     category_id = Column(Integer, nullable=False)
-    seller_id = Column(String(100), nullable=False)
+    seller_id = Column(String(100), ForeignKey('sellers.seller_id'), nullable=False, index=True)
     price = Column(Float)
     sum_sale = Column(Float)
     additional_data = Column(Text)
+    # типизированные копии полей additional_data для фильтров и сортировки в SQL
+    up_vy = Column(Float, info={"backfill": "json_extract(additional_data, '$.up_vy')"})
+    up_vy_pr = Column(Float, info={"backfill": "json_extract(additional_data, '$.up_vy_pr')"})
+    feedbacks = Column(Integer, info={"backfill": "json_extract(additional_data, '$.feedbacks')"})
+    trend = Column(Float, info={"backfill": "json_extract(additional_data, '$.trend')"})
+    row_hash = Column(String(40))
+    seller = relationship("Seller", back_populates="skus")
+
+    __table_args__ = (
+        Index('ix_skus_category_id_sum_sale', 'category_id', sum_sale.desc()),
+        Index('ix_skus_price', 'price'),
+        Index('ix_skus_up_vy_id', 'up_vy', 'id'),
+        Index('ix_skus_feedbacks_id', 'feedbacks', 'id'),
+    )
+
+class StatsTable(BaseTable):
+    __abstract__ = True
+    sku_count = Column(Integer, nullable=False, default=0)
+    total_sale = Column(Float, nullable=False, default=0)
+    avg_sale = Column(Float, nullable=False, default=0)
+    price_p25 = Column(Float)
+    price_p50 = Column(Float)
+    price_p75 = Column(Float)
+
+class SellerStats(StatsTable):
+    __tablename__ = 'seller_stats'
+    seller_id = Column(String(100), primary_key=True)
+
+class CategoryStats(StatsTable):
+    __tablename__ = 'category_stats'
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
 
-db.create_tables()
\ No newline at end of file
+class BrandStats(StatsTable):
+    __tablename__ = 'brand_stats'
+    brand = Column(String(200), primary_key=True)
@@ -0,0 +1,140 @@
+from operator import itemgetter
+import numpy as np
+
+# frame — словарь колонок одной длины; текстовые колонки object: фиксированная
+# ширина обрезала бы длинные seller_id и name, а структурный массив с полями
+# object медленно создаётся
+FRAME_COLUMNS = {
+    "id_cat": np.int64,
+    "seller_id": object,
+    "name": object,
+    "store": object,
+    "brand": object,
+    "price": np.float64,
+    "sum_sale": np.float64,
+    "up_vy": np.float64,
+    "up_vy_pr": np.float64,
+    "feedbacks": np.float64,
+}
+STRING_FIELDS = ("name", "store", "brand")
+QUARTILES = (0.25, 0.5, 0.75)
+
+
+def column(items, field, default=None):
+    # у ответов API схема полная, поэтому обычно хватает itemgetter без вызова .get на строку
+    try:
+        return list(map(itemgetter(field), items))
+    except KeyError:
+        return [item.get(field, default) for item in items]
+
+
+def as_objects(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def to_frame(data, columns=None):
+    # columns — только нужные колонки: остальные поля из dict не извлекаются
+    columns = list(columns or FRAME_COLUMNS)
+    items = [item for item in data if isinstance(item, dict)]
+    if not items:
+        return {name: np.empty(0, dtype=FRAME_COLUMNS[name]) for name in columns}
+
+    frame = {}
+    for name in columns:
+        if name == "seller_id":
+            seller_ids = list(map(str, column(items, "id", "")))
+            for i in [i for i, seller_id in enumerate(seller_ids) if not seller_id]:
+                seller_ids[i] = str(items[i].get("seller_id", ""))
+            frame[name] = as_objects(seller_ids)
+        elif name == "id_cat":
+            frame[name] = np.nan_to_num(np.array(column(items, name), dtype=np.float64)).astype(np.int64)
+        elif name in STRING_FIELDS:
+            frame[name] = as_objects([value or "" for value in column(items, name)])
+        else:
+            # None превращается в NaN, числа-строки из API приводятся к float
+            frame[name] = np.array(column(items, name), dtype=np.float64)
+    return frame
+
+
+def length(frame):
+    return len(next(iter(frame.values())))
+
+
+def take(frame, index):
+    return {name: values[index] for name, values in frame.items()}
+
+
+def group_codes(values):
+    # np.unique по object-массиву сравнивает строки Python при сортировке;
+    # словарь кодирует ключи за один проход, группы идут в порядке появления
+    if values.dtype != object:
+        return np.unique(values, return_inverse=True)
+    codes = {}
+    inverse = np.fromiter(
+        (codes.setdefault(value, len(codes)) for value in values.tolist()), dtype=np.int64, count=len(values)
+    )
+    return as_objects(list(codes)), inverse
+
+
+def group_by(frame, key, value="sum_sale"):
+    keys, inverse = group_codes(frame[key])
+    values = np.nan_to_num(frame[value])
+    counts = np.bincount(inverse, minlength=len(keys))
+    sums = np.bincount(inverse, weights=values, minlength=len(keys))
+    return {
+        "key": keys,
+        "count": counts,
+        "sum": sums,
+        "mean": sums / np.maximum(counts, 1),
+    }
+
+
+def group_quantiles(frame, key, value, quantiles=QUARTILES):
+    # то же, что statistics.quantiles(method="inclusive") по каждой группе;
+    # NaN не учитываются, у группы без значений квантили NaN
+    keys, inverse = group_codes(frame[key])
+    values = frame[value]
+    order = np.lexsort((values, inverse))
+    ordered = values[order]
+    counts = np.bincount(inverse, minlength=len(keys))
+    present = np.bincount(inverse, weights=~np.isnan(values), minlength=len(keys)).astype(np.int64)
+    starts = np.cumsum(counts) - counts
+    last = np.maximum(present - 1, 0)
+
+    result = {"key": keys}
+    for quantile in quantiles:
+        position = quantile * last
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        below, above = ordered[starts + low], ordered[starts + high]
+        result[quantile] = np.where(present > 0, below + (above - below) * (position - low), np.nan)
+    return result
+
+
+def top_n(frame, column="sum_sale", n=10, key=None):
+    values = np.nan_to_num(frame[column], nan=-np.inf)
+    if key is None:
+        if len(values) <= n:
+            return take(frame, np.argsort(-values, kind="stable"))
+        top = np.argpartition(-values, n)[:n]
+        return take(frame, top[np.argsort(-values[top], kind="stable")])
+
+    # сортировка по (группа, -значение), затем первые n строк каждой группы
+    _, groups = group_codes(frame[key])
+    order = np.lexsort((-values, groups))
+    starts = np.searchsorted(groups[order], groups[order], side="left")
+    rank = np.arange(len(order)) - starts
+    return take(frame, order[rank < n])
+
+
+def records(frame, columns):
+    # готовые словари для BulkIngest.upsert; NaN в числовых колонках становится NULL
+    values = []
+    for name in columns:
+        data = frame[name].tolist()
+        if frame[name].dtype.kind == "f":
+            data = [None if value != value else value for value in data]
+        values.append(data)
+    return [dict(zip(columns, row)) for row in zip(*values)]
@@ -0,0 +1,21 @@
+import aiohttp
+
+HTTP_LIMIT = 100
+HTTP_LIMIT_PER_HOST = 20
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_TIMEOUT = 30
+
+
+def create_session():
+    # общий пул соединений и таймаут для всех загрузчиков niches.php
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    )
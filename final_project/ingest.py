@@ -0,0 +1,83 @@
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+BATCH_SIZE = 500
+KEYS_PER_QUERY = 500
+
+UPSERT_DIALECTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+class BulkIngest:
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def build_statement(self, dialect, table, key, columns):
+        dialect_insert = UPSERT_DIALECTS.get(dialect)
+        if dialect_insert is None:
+            return insert(table)
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: stmt.excluded[column] for column in columns if column != key}
+        )
+
+    async def upsert(self, session, model, rows, key):
+        if not rows:
+            return 0
+        dialect = session.bind.dialect.name
+        stmt = self.build_statement(dialect, model.__table__, key, rows[0].keys())
+        for start in range(0, len(rows), self.batch_size):
+            await session.execute(stmt, rows[start:start + self.batch_size])
+        return len(rows)
+
+    async def lookup_ids(self, session, model, names):
+        # справочник по name: недостающие имена вставляются, возвращается {name: id}
+        names = sorted({name for name in names if name})
+        ids = {}
+        if not names:
+            return ids
+        dialect_insert = UPSERT_DIALECTS.get(session.bind.dialect.name)
+        for start in range(0, len(names), KEYS_PER_QUERY):
+            chunk = names[start:start + KEYS_PER_QUERY]
+            if dialect_insert is not None:
+                stmt = dialect_insert(model.__table__).on_conflict_do_nothing(index_elements=["name"])
+                await session.execute(stmt, [{"name": name} for name in chunk])
+            else:
+                result = await session.execute(select(model.name).where(model.name.in_(chunk)))
+                existing = set(result.scalars().all())
+                missing = [{"name": name} for name in chunk if name not in existing]
+                if missing:
+                    await session.execute(insert(model.__table__), missing)
+            result = await session.execute(select(model.name, model.id).where(model.name.in_(chunk)))
+            ids.update(result.all())
+        return ids
+
+    async def attach_ids(self, session, rows, field, model, id_field):
+        ids = await self.lookup_ids(session, model, [row[field] for row in rows])
+        attached = []
+        for row in rows:
+            row = dict(row)
+            row[id_field] = ids.get(row.pop(field))
+            attached.append(row)
+        return attached
+
+    async def changed_rows(self, session, model, rows, key):
+        # строки, чей хэш отличается от сохранённого (или которых ещё нет)
+        key_column = getattr(model, key)
+        stored = {}
+        keys = [row[key] for row in rows]
+        for start in range(0, len(keys), KEYS_PER_QUERY):
+            result = await session.execute(
+                select(key_column, model.row_hash).where(key_column.in_(keys[start:start + KEYS_PER_QUERY]))
+            )
+            stored.update(result.all())
+
+        return [row for row in rows if stored.get(row[key]) != row["row_hash"]]
+
+    async def upsert_changed(self, session, model, rows, key):
+        changed = await self.changed_rows(session, model, rows, key)
+        await self.upsert(session, model, changed, key)
+        return changed
@@ -0,0 +1,70 @@
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+
+
+class JsonArrayDecoder:
+    """Incrementally decodes a top-level JSON array fed in byte chunks."""
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.started = False
+        self.finished = False
+
+    def _skip_whitespace(self, pos):
+        while pos < len(self.buffer) and self.buffer[pos] in WHITESPACE:
+            pos += 1
+        return pos
+
+    def feed(self, chunk, final=False):
+        self.buffer += self.text_decoder.decode(chunk, final)
+        items = []
+        pos = 0
+
+        while not self.finished:
+            pos = self._skip_whitespace(pos)
+            if pos >= len(self.buffer):
+                break
+
+            if not self.started:
+                if self.buffer[pos] != "[":
+                    # null вместо массива — пустая страница, как у response.json()
+                    if "null".startswith(self.buffer[pos:].rstrip()):
+                        break
+                    raise ValueError("Ожидался JSON массив")
+                self.started = True
+                pos += 1
+                continue
+
+            char = self.buffer[pos]
+            if char == "]":
+                self.finished = True
+                pos += 1
+                break
+            if char == ",":
+                pos += 1
+                continue
+
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                break
+            # число в конце буфера может продолжиться в следующем чанке
+            if end == len(self.buffer) and not isinstance(item, (dict, list)) and not final:
+                break
+            items.append(item)
+            pos = end
+
+        self.buffer = self.buffer[pos:]
+        return items
+
+    def close(self):
+        items = self.feed(b"", final=True)
+        if not self.started and self.buffer.strip() in ("", "null"):
+            return items
+        if not self.finished or self.buffer.strip():
+            raise ValueError("Неполный JSON массив")
+        return items
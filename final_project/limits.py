@@ -0,0 +1,107 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = Counter()
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.values[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, counters=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.counters = counters or Counters()
+
+    def reserve(self):
+        # токен резервируется сразу, поэтому ожидающие обслуживаются по очереди
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+        self.counters.incr("throttled")
+        return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class RateLimiter:
+    def __init__(self, rate, capacity=None, counters=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.counters = counters or Counters()
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.capacity, self.counters)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    async def acquire_async(self, url):
+        await self.bucket(url).acquire_async()
+
+
+class RetryPolicy:
+    def __init__(self, attempts=5, base_delay=0.5, max_delay=30, counters=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.counters = counters or Counters()
+
+    def should_retry(self, status):
+        return status in RETRY_STATUSES
+
+    def parse_retry_after(self, value):
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, retry_after=None):
+        self.counters.incr("retries")
+        retry_after = self.parse_retry_after(retry_after)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
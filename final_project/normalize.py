@@ -0,0 +1,103 @@
+import hashlib
+import json
+from itertools import repeat
+
+CHUNK_SIZE = 1000
+SELLER_FIELDS = ("seller_id", "name", "store", "brand")
+SKU_FIELDS = (
+    "sku_id", "name", "category_id", "seller_id", "price", "sum_sale", "additional_data",
+    "up_vy", "up_vy_pr", "feedbacks", "trend"
+)
+SELLER_ROW_FIELDS = SELLER_FIELDS + ("row_hash",)
+SKU_ROW_FIELDS = SKU_FIELDS + ("row_hash",)
+
+
+def row_hash(row):
+    payload = json.dumps(row, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def to_number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def with_hash(fields, values):
+    return values + (row_hash(dict(zip(fields, values))),)
+
+
+def normalize_chunk(items, category_id):
+    # без общего состояния, поэтому чанки можно разбирать в ProcessPoolExecutor;
+    # дубликаты отбрасывает dedupe в родительском процессе
+    sellers = []
+    skus = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+
+        seller_id = str(item.get('id', '')) or str(item.get('seller_id', ''))
+        if not seller_id:
+            continue
+
+        sellers.append(with_hash(SELLER_FIELDS, (
+            seller_id,
+            item.get('name', '')[:200],
+            item.get('store', ''),
+            item.get('brand', '')
+        )))
+
+        additional = {
+            'up_vy': item.get('up_vy'),
+            'up_vy_pr': item.get('up_vy_pr'),
+            'feedbacks': item.get('feedbacks'),
+            'trend': item.get('trend')
+        }
+        skus.append(with_hash(SKU_FIELDS, (
+            str(item.get('id_cat', '')) + "_" + seller_id,
+            item.get('name', '')[:500],
+            category_id,
+            seller_id,
+            float(item.get('price', 0)),
+            float(item.get('sum_sale', 0)),
+            json.dumps(additional),
+            to_number(additional['up_vy']),
+            to_number(additional['up_vy_pr']),
+            to_number(additional['feedbacks'], int),
+            to_number(additional['trend'])
+        )))
+
+    return sellers, skus
+
+
+def dedupe(rows, seen):
+    unique = []
+    for row in rows:
+        if row[0] not in seen:
+            seen.add(row[0])
+            unique.append(row)
+    return unique
+
+
+def as_dicts(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def normalize_items(items, category_id, sellers_seen, skus_seen):
+    sellers, skus = normalize_chunk(items, category_id)
+    return (
+        as_dicts(SELLER_ROW_FIELDS, dedupe(sellers, sellers_seen)),
+        as_dicts(SKU_ROW_FIELDS, dedupe(skus, skus_seen))
+    )
+
+
+def normalize_with_pool(executor, items, category_id, sellers_seen, skus_seen, chunk_size=CHUNK_SIZE):
+    # executor.map сохраняет порядок чанков, поэтому результат совпадает с последовательным разбором
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    sellers = []
+    skus = []
+    for chunk_sellers, chunk_skus in executor.map(normalize_chunk, chunks, repeat(category_id)):
+        sellers.extend(dedupe(chunk_sellers, sellers_seen))
+        skus.extend(dedupe(chunk_skus, skus_seen))
+    return sellers, skus
@@ -0,0 +1,157 @@
+import asyncio
+from sqlalchemy import select
+from cache_client import cache
+from db import async_db, Brand, Seller, SKU, Store
+from normalize import SELLER_ROW_FIELDS, SKU_ROW_FIELDS, as_dicts, dedupe, normalize_chunk
+
+QUEUE_SIZE = 4
+KEYS_PER_QUERY = 500
+
+
+class CategoryState:
+    def __init__(self, category_id):
+        self.category_id = category_id
+        self.sellers_seen = set()
+        self.skus_seen = set()
+        self.changed_sellers = set()
+        self.changed_skus = 0
+        self.brands = set()
+
+    def result(self):
+        return {
+            "sellers": len(self.sellers_seen),
+            "skus": len(self.skus_seen),
+            "changed_sellers": len(self.changed_sellers),
+            "changed_skus": self.changed_skus
+        }
+
+
+class IngestPipeline:
+    # fetch -> normalize -> write; очереди ограничены, поэтому быстрая стадия
+    # ждёт медленную, а не копит страницы в памяти
+    def __init__(self, parser, ingest, stats, executor=None, queue_size=QUEUE_SIZE):
+        self.parser = parser
+        self.ingest = ingest
+        self.stats = stats
+        self.executor = executor
+        self.raw = asyncio.Queue(queue_size)
+        self.parsed = asyncio.Queue(queue_size)
+        self.rows = asyncio.Queue(queue_size)
+
+    async def fetch(self, category_id):
+        try:
+            async for items in self.parser.stream_category(category_id):
+                await self.raw.put((category_id, items))
+        finally:
+            # None закрывает категорию на следующих стадиях
+            await self.raw.put((category_id, None))
+
+    def submit(self, items, category_id):
+        loop = asyncio.get_running_loop()
+        if self.executor is not None:
+            return loop.run_in_executor(self.executor, normalize_chunk, items, category_id)
+        future = loop.create_future()
+        future.set_result(normalize_chunk(items, category_id))
+        return future
+
+    async def normalize(self, categories_left):
+        # в очереди parsed лежат futures: с пулом процессов несколько чанков
+        # разбираются параллельно, а порядок сохраняется для dedupe
+        while categories_left:
+            category_id, items = await self.raw.get()
+            if items is None:
+                categories_left -= 1
+                await self.parsed.put((category_id, None))
+                continue
+            await self.parsed.put((category_id, self.submit(items, category_id)))
+
+    async def collect(self, states, categories_left):
+        while categories_left:
+            category_id, future = await self.parsed.get()
+            if future is None:
+                categories_left -= 1
+                await self.rows.put((category_id, None))
+                continue
+            state = states[category_id]
+            sellers, skus = await future
+            sellers = as_dicts(SELLER_ROW_FIELDS, dedupe(sellers, state.sellers_seen))
+            skus = as_dicts(SKU_ROW_FIELDS, dedupe(skus, state.skus_seen))
+            await self.rows.put((category_id, (sellers, skus)))
+
+    async def write(self, states, categories_left, progress):
+        async with async_db.Session() as session:
+            while categories_left:
+                category_id, batch = await self.rows.get()
+                state = states[category_id]
+                if batch is None:
+                    categories_left -= 1
+                    await self.finish_category(session, state)
+                    continue
+
+                sellers, skus = batch
+                sellers = await self.ingest.changed_rows(session, Seller, sellers, "seller_id")
+                old_brands = await self.stats.brands_of(session, [seller["seller_id"] for seller in sellers])
+                seller_rows = await self.ingest.attach_ids(session, sellers, "store", Store, "store_id")
+                seller_rows = await self.ingest.attach_ids(session, seller_rows, "brand", Brand, "brand_id")
+                await self.ingest.upsert(session, Seller, seller_rows, "seller_id")
+                skus = await self.ingest.upsert_changed(session, SKU, skus, "sku_id")
+                touched = {seller["seller_id"] for seller in sellers} | {sku["seller_id"] for sku in skus}
+                state.brands |= await self.stats.refresh(session, seller_ids=touched, brands=old_brands)
+                await session.commit()
+                state.changed_sellers |= touched
+                state.changed_skus += len(skus)
+                if progress is not None:
+                    await progress(category_id, skus=len(state.skus_seen), changed_skus=state.changed_skus)
+
+    async def finish_category(self, session, state):
+        if state.changed_skus:
+            await self.stats.refresh(session, category_ids=[state.category_id])
+            await session.commit()
+
+        if state.changed_sellers or state.changed_skus:
+            tags = ["sellers"]
+            if state.changed_skus:
+                tags.append("skus")
+            # ответ категории содержит магазин и бренд продавцов, поэтому он устаревает
+            # и при изменении одного продавца — во всех категориях, где тот продаёт
+            categories = await self.categories_of(session, state.changed_sellers)
+            if state.changed_skus:
+                categories.add(state.category_id)
+            await cache.invalidate_tags(
+                *tags,
+                *[f"category:{category_id}" for category_id in categories],
+                *[f"seller:{seller_id}" for seller_id in state.changed_sellers],
+                *[f"brand:{brand}" for brand in state.brands]
+            )
+
+        if not state.skus_seen:
+            print(f"Нет данных {state.category_id}")
+            return
+
+        print(
+            f"Категория {state.category_id}: {len(state.sellers_seen)} продавцов, {len(state.skus_seen)} SKU, "
+            f"изменено {len(state.changed_sellers)} продавцов и {state.changed_skus} SKU"
+        )
+
+    async def categories_of(self, session, seller_ids):
+        seller_ids = list(seller_ids)
+        categories = set()
+        for start in range(0, len(seller_ids), KEYS_PER_QUERY):
+            result = await session.execute(
+                select(SKU.category_id).where(SKU.seller_id.in_(seller_ids[start:start + KEYS_PER_QUERY])).distinct()
+            )
+            categories.update(result.scalars().all())
+        return categories
+
+    async def run(self, categories, progress=None):
+        states = {category_id: CategoryState(category_id) for category_id in categories}
+        tasks = [asyncio.create_task(self.fetch(category_id)) for category_id in categories]
+        tasks.append(asyncio.create_task(self.normalize(len(categories))))
+        tasks.append(asyncio.create_task(self.collect(states, len(categories))))
+        tasks.append(asyncio.create_task(self.write(states, len(categories), progress)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return {category_id: state.result() for category_id, state in states.items()}
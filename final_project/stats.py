@@ -0,0 +1,68 @@
+import numpy as np
+from sqlalchemy import delete, select
+from db import Brand, Seller, SKU, SellerStats, CategoryStats, BrandStats
+from frames import as_objects, group_by, group_quantiles, records
+from ingest import BulkIngest
+
+KEYS_PER_QUERY = 500
+
+
+class StatsUpdater:
+    def __init__(self, ingest=None):
+        self.ingest = ingest or BulkIngest()
+
+    async def brands_of(self, session, seller_ids):
+        seller_ids = list(seller_ids)
+        brands = set()
+        for start in range(0, len(seller_ids), KEYS_PER_QUERY):
+            result = await session.execute(
+                select(Brand.name)
+                .join(Seller, Seller.brand_id == Brand.id)
+                .where(Seller.seller_id.in_(seller_ids[start:start + KEYS_PER_QUERY]))
+                .distinct()
+            )
+            brands.update(result.scalars().all())
+        return brands
+
+    async def refresh(self, session, seller_ids=(), category_ids=(), brands=()):
+        # brands — бренды продавцов до upsert: при смене бренда пересчитывается и старый
+        seller_ids = list(seller_ids)
+        brands = set(brands) | await self.brands_of(session, seller_ids)
+
+        await self.refresh_dimension(session, SellerStats, "seller_id", SKU.seller_id, seller_ids)
+        await self.refresh_dimension(session, CategoryStats, "category_id", SKU.category_id, list(category_ids))
+        await self.refresh_dimension(session, BrandStats, "brand", Brand.name, list(brands), join_brands=True)
+        return brands
+
+    async def refresh_dimension(self, session, model, key, column, keys, join_brands=False):
+        for start in range(0, len(keys), KEYS_PER_QUERY):
+            chunk = keys[start:start + KEYS_PER_QUERY]
+            stmt = select(column, SKU.price, SKU.sum_sale).where(column.in_(chunk))
+            if join_brands:
+                stmt = stmt.join(Seller, Seller.seller_id == SKU.seller_id).join(Brand, Brand.id == Seller.brand_id)
+            result = await session.execute(stmt)
+
+            # агрегаты считаются по колонкам, а не группа за группой в Python
+            found = result.all()
+            frame = {
+                "key": as_objects([row[0] for row in found]),
+                "price": np.array([row[1] for row in found], dtype=np.float64),
+                "sum_sale": np.array([row[2] for row in found], dtype=np.float64),
+            }
+            groups = group_by(frame, "key")
+            prices = group_quantiles(frame, "key", "price")
+            rows = records({
+                key: groups["key"],
+                "sku_count": groups["count"],
+                "total_sale": groups["sum"],
+                "avg_sale": groups["mean"],
+                "price_p25": prices[0.25],
+                "price_p50": prices[0.5],
+                "price_p75": prices[0.75],
+            }, [key, "sku_count", "total_sale", "avg_sale", "price_p25", "price_p50", "price_p75"])
+            await self.ingest.upsert(session, model, rows, key)
+
+            # у ключа не осталось SKU (например, бренд ушёл от последнего продавца)
+            empty = set(chunk) - {row[key] for row in rows}
+            if empty:
+                await session.execute(delete(model).where(getattr(model, key).in_(empty)))
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from cache_client import INGEST_JOBS_KEY, INGEST_QUEUED_KEY, INGEST_STATUS_KEY, REDIS_HOST, REDIS_PORT, REDIS_DB
+from app import DataService, SYNC_CATEGORIES
+from db import async_db
+
+WORKERS = 3
+NORMALIZE_WORKERS = 0
+SYNC_INTERVAL = 600
+JOB_POLL_TIMEOUT = 5
+JOB_HEARTBEAT_TIMEOUT = 300
+
+
+def create_queue_client():
+    # у клиента API socket_timeout 0.5 с, а BLPOP блокируется дольше
+    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+
+
+async def set_status(client, category_id, state, **fields):
+    status = {"state": state, "updated": time.time(), **fields}
+    await client.hset(INGEST_STATUS_KEY, category_id, json.dumps(status))
+
+
+async def enqueue(client, categories):
+    queued = []
+    for category_id in categories:
+        current = await client.hget(INGEST_STATUS_KEY, category_id)
+        if current:
+            status = json.loads(current)
+            # воркер обновляет статус на каждом батче; задача, молчащая дольше
+            # JOB_HEARTBEAT_TIMEOUT, считается зависшей (упавший воркер) и ставится заново
+            if status["state"] == "running" and time.time() - status["updated"] < JOB_HEARTBEAT_TIMEOUT:
+                continue
+        # категория уже лежит в очереди и ещё не взята воркером
+        if not await client.sadd(INGEST_QUEUED_KEY, category_id):
+            continue
+        await set_status(client, category_id, "queued")
+        await client.rpush(INGEST_JOBS_KEY, category_id)
+        queued.append(category_id)
+    return queued
+
+
+async def run_job(client, service, category_id, worker_id):
+    started = time.time()
+
+    async def progress(_category_id, **fields):
+        await set_status(client, category_id, "running", worker=worker_id, started=started, **fields)
+
+    await progress(category_id)
+    try:
+        result = await service.sync_category(category_id, progress)
+    except Exception as error:
+        print(f"Воркер {worker_id}: ошибка загрузки категории {category_id}: {error}")
+        await set_status(client, category_id, "failed", worker=worker_id, started=started, error=str(error))
+        return
+    await set_status(client, category_id, "done", worker=worker_id, started=started, finished=time.time(), **result)
+
+
+async def work(worker_id, once=False, normalize_workers=NORMALIZE_WORKERS):
+    client = create_queue_client()
+    service = DataService(normalize_workers)
+    await service.parser.start()
+    try:
+        while True:
+            job = await client.blpop(INGEST_JOBS_KEY, timeout=JOB_POLL_TIMEOUT)
+            if job is None:
+                if once:
+                    break
+                continue
+            category_id = int(job[1])
+            await client.srem(INGEST_QUEUED_KEY, category_id)
+            await run_job(client, service, category_id, worker_id)
+    finally:
+        print(f"Воркер {worker_id}: {service.parser.counters.snapshot()}")
+        await service.close()
+        await async_db.close()
+        await client.aclose()
+
+
+def run_worker(worker_id, once=False, normalize_workers=NORMALIZE_WORKERS):
+    asyncio.run(work(worker_id, once, normalize_workers))
+
+
+async def migrate():
+    # единственная точка миграций: API только проверяет схему при старте
+    await async_db.create_tables()
+    await async_db.close()
+
+
+async def schedule(categories, interval):
+    client = create_queue_client()
+    try:
+        while True:
+            try:
+                queued = await enqueue(client, categories)
+                print(f"В очередь поставлены категории: {queued}")
+            except RedisError as error:
+                print(f"Ошибка планировщика: {error}")
+            await asyncio.sleep(interval)
+    finally:
+        await client.aclose()
+
+
+def run_workers(workers=WORKERS, categories=SYNC_CATEGORIES, interval=SYNC_INTERVAL, normalize_workers=NORMALIZE_WORKERS):
+    # схема обновляется до старта воркеров, чтобы никто не читал её посреди ALTER TABLE
+    asyncio.run(migrate())
+    # spawn: каждый воркер поднимает свой event loop, пул БД и соединения Redis
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(worker_id, False, normalize_workers))
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        asyncio.run(schedule(categories, interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+if __name__ == "__main__" and sys.argv[1:] == ["migrate"]:
+    print("Миграция схемы БД")
+    asyncio.run(migrate())
+elif __name__ == "__main__":
+    print("Запуск воркеров загрузки")
+    run_workers(
+        int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS,
+        normalize_workers=int(sys.argv[2]) if len(sys.argv) > 2 else NORMALIZE_WORKERS
+    )
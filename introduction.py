@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
 class BaseParser:
@@ -15,8 +16,10 @@ class WoysaParser(BaseParser):
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self):
+    def __init__(self, page_size=100, max_workers=3):
         self.base_url = "https://analitika.woysa.club/images/panel/json/download/niches.php"
+        self.page_size = page_size
+        self.max_workers = max_workers
 
     def download(self, skip, category):
         url = self.base_url + f"?skip={skip}&price_min=0&price_max=1060225&up_vy_min=0&up_vy_max=108682515&up_vy_pr_min=0&up_vy_pr_max=2900&sum_min=1000&sum_max=82432725&feedbacks_min=0&feedbacks_max=32767&trend=false&sort=sum_sale&sort_dir=-1&id_cat={category}"
@@ -27,12 +30,21 @@ class WoysaParser(BaseParser):
     def loader(self, categories):
         all_data = []
 
-        for category in categories:
-            for page in range(10):
-                skip = page * 100
-                data = self.download(skip, category)
-                if data:
-                    all_data.extend(data)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for category in categories:
+                skip = 0
+                finished = False
+                while not finished:
+                    skips = [skip + i * self.page_size for i in range(self.max_workers)]
+                    skip = skips[-1] + self.page_size
+                    pages = executor.map(lambda s: self.download(s, category), skips)
+
+                    for data in pages:
+                        if data:
+                            all_data.extend(data)
+                        if not data or len(data) < self.page_size:
+                            finished = True
+                            break
 
         return all_data
 
@@ -1,8 +1,8 @@
 import asyncio
-import aiohttp
 from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, joinedload
 from datetime import datetime
+from final_project.http_client import create_session
 
 class BaseParser:
     def loader(self, categories):
@@ -22,27 +22,41 @@ class WoysaParser(BaseParser):
 
     def __init__(self):
         self.base_url = "https://analitika.woysa.club/images/panel/json/download/niches.php"
+        if not hasattr(self, "session"):
+            self.session = None
 
-    async def download(self, session, skip, category):
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = create_session()
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def download(self, skip, category):
         url = self.base_url + f"?skip={skip}&price_min=0&price_max=1060225&up_vy_min=0&up_vy_max=108682515&up_vy_pr_min=0&up_vy_pr_max=2900&sum_min=1000&sum_max=82432725&feedbacks_min=0&feedbacks_max=32767&trend=false&sort=sum_sale&sort_dir=-1&id_cat={category}"
-        async with session.get(url) as response:
+        async with self.get_session().get(url) as response:
             if response.status == 200:
                 return await response.json()
             return []
 
     async def loader(self, categories):
         all_data = []
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for cat in categories:
-                for skip in [0, 100, 200]:
-                    task = self.download(session, skip, cat)
-                    tasks.append(task)
+        tasks = []
+        for cat in categories:
+            for skip in [0, 100, 200]:
+                task = self.download(skip, cat)
+                tasks.append(task)
 
+        try:
             for task in asyncio.as_completed(tasks):
                 page_data = await task
                 if page_data:
                     all_data.extend(page_data)
+        finally:
+            await self.close()
 
         return all_data
 
@@ -159,7 +173,14 @@ class OrderFiller:
 
 def display_orders():
     session = db.get_session()
-    orders = session.query(Order).order_by(Order.order_date.desc()).limit(10).all()
+    # товар и поставщик подтягиваются одним запросом с JOIN вместо ленивой загрузки на каждый заказ
+    orders = (
+        session.query(Order)
+        .options(joinedload(Order.product).joinedload(Product.supplier))
+        .order_by(Order.order_date.desc())
+        .limit(10)
+        .all()
+    )
 
     for i, order in enumerate(orders, 1):
         print(f"\n{i}. Заказ #{order.id}")
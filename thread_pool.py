@@ -1,5 +1,8 @@
-from concurrent.futures import ThreadPoolExecutor
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import requests
+from final_project.limits import Counters, RateLimiter, RetryPolicy
+from final_project.normalize import normalize_with_pool
 
 class BaseParser:
     def loader(self, categories):
@@ -18,12 +21,32 @@ class WoysaParser(BaseParser):
 
     def __init__(self):
         self.base_url = "https://analitika.woysa.club/images/panel/json/download/niches.php"
+        if not hasattr(self, "counters"):
+            self.counters = Counters()
+            self.limiter = RateLimiter(10, 20, self.counters)
+            self.retry = RetryPolicy(counters=self.counters)
 
     def download(self, category):
         url = f"{self.base_url}?id_cat={category}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
+        last_attempt = self.retry.attempts - 1
+        for attempt in range(self.retry.attempts):
+            self.limiter.acquire(url)
+            try:
+                response = requests.get(url, timeout=30)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == last_attempt:
+                    raise
+                time.sleep(self.retry.delay(attempt))
+                continue
+
+            if attempt < last_attempt and self.retry.should_retry(response.status_code):
+                time.sleep(self.retry.delay(attempt, response.headers.get("Retry-After")))
+                continue
+            if self.retry.should_retry(response.status_code):
+                response.raise_for_status()
+            if response.status_code == 200:
+                return response.json()
+            return []
 
     def loader(self, categories):
         all_data = []
@@ -34,6 +57,19 @@ class WoysaParser(BaseParser):
                 all_data.extend(result)
         return all_data
 
+    def load_rows(self, categories, processes=3):
+        # потоки ждут сеть, а разбор строк уходит в процессы мимо GIL
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            pages = list(executor.map(self.download, categories))
+
+        sellers_seen = set()
+        skus_seen = set()
+        rows = {}
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for category, data in zip(categories, pages):
+                rows[category] = normalize_with_pool(executor, data, category, sellers_seen, skus_seen)
+        return rows
+
     def to_dict(self, data):
         result = {
             "total": len(data),